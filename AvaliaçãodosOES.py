@@ -2,26 +2,151 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from sklearn.decomposition import PCA
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix
+from joblib import Parallel, delayed, cpu_count
 import matplotlib.pyplot as plt
 import logging
 
+# Numba é opcional: quando disponível, usa um kernel compilado de similaridade
+try:
+    from numba import njit, prange
+    NUMBA_DISPONIVEL = True
+except ImportError:
+    NUMBA_DISPONIVEL = False
+
+# chunkdot é opcional: similaridade top-K em blocos, sem materializar
+# a matriz M x N completa quando o banco de referência é muito grande
+try:
+    from chunkdot import cosine_similarity_top_k
+    CHUNKDOT_DISPONIVEL = True
+except ImportError:
+    CHUNKDOT_DISPONIVEL = False
+
+# CuPy é opcional: quando instalado, o GEMM de similaridade de bancos
+# grandes é executado na GPU
+try:
+    import cupy as cp
+    CUPY_DISPONIVEL = True
+except ImportError:
+    CUPY_DISPONIVEL = False
+
+# Caminho GPU habilitado apenas quando o CuPy está presente
+USAR_GPU = CUPY_DISPONIVEL
+
 # Configuração de logging para depuração
 logging.basicConfig(level=logging.DEBUG)
 
+if NUMBA_DISPONIVEL:
+    @st.cache_resource(show_spinner=False)
+    def obter_nucleo_cosseno():
+        """
+        Compila o kernel de similaridade uma única vez por processo.
+
+        A assinatura explícita dispara a compilação já na criação (e não na
+        primeira chamada) e, com cache=True, o código compilado é restaurado
+        do disco entre reinícios do processo; o st.cache_resource garante
+        que as reexecuções do Streamlit reutilizem o mesmo objeto compilado.
+
+        Retorno:
+        callable: Kernel compilado (teste, referencias, saida).
+        """
+        @njit(
+            "void(float32[:, ::1], float32[:, ::1], float32[:, ::1])",
+            parallel=True,
+            fastmath=True,
+            cache=True,
+        )
+        def _nucleo_cosseno(teste, referencias, saida):
+            # Funde produto escalar e normas em uma única passada sobre
+            # cada par de espectros (M x N similaridades)
+            for i in prange(teste.shape[0]):
+                for j in range(referencias.shape[0]):
+                    produto = 0.0
+                    norma_teste = 0.0
+                    norma_ref = 0.0
+                    for k in range(teste.shape[1]):
+                        a = teste[i, k]
+                        b = referencias[j, k]
+                        produto += a * b
+                        norma_teste += a * a
+                        norma_ref += b * b
+                    saida[i, j] = produto / (
+                        np.sqrt(norma_teste) * np.sqrt(norma_ref)
+                    )
+
+        return _nucleo_cosseno
+
+    @st.cache_resource(show_spinner=False)
+    def obter_nucleo_cosseno_max():
+        """
+        Compila o kernel que retém apenas o máximo por amostra.
+
+        O máximo corrente é mantido em registrador durante a varredura das
+        referências, sem alocar a matriz M x N de similaridades.
+
+        Retorno:
+        callable: Kernel compilado (teste, referencias, saida).
+        """
+        @njit(
+            "void(float32[:, ::1], float32[:, ::1], float32[::1])",
+            parallel=True,
+            fastmath=True,
+            cache=True,
+        )
+        def _nucleo_cosseno_max(teste, referencias, saida):
+            for i in prange(teste.shape[0]):
+                melhor = np.float32(-1.0)
+                for j in range(referencias.shape[0]):
+                    produto = 0.0
+                    norma_teste = 0.0
+                    norma_ref = 0.0
+                    for k in range(teste.shape[1]):
+                        a = teste[i, k]
+                        b = referencias[j, k]
+                        produto += a * b
+                        norma_teste += a * a
+                        norma_ref += b * b
+                    cos = produto / (
+                        np.sqrt(norma_teste) * np.sqrt(norma_ref)
+                    )
+                    if cos > melhor:
+                        melhor = cos
+                saida[i] = melhor
+
+        return _nucleo_cosseno_max
+
 # Função para carregar espectros GC-MS
-def carregar_espectros(caminho):
+@st.cache_data(show_spinner=False)
+def carregar_espectros(caminho, usecols=None):
     """
     Carrega os dados espectrais de óleos essenciais de um arquivo CSV.
 
+    O resultado fica em cache entre reexecuções do Streamlit, evitando
+    reparsear o mesmo arquivo a cada clique. As colunas são lidas direto
+    em float32 — abundâncias percentuais de GC-MS cabem com folga nos
+    ~7 dígitos significativos do formato — o que corta pela metade os
+    bytes parseados e residentes em memória.
+
     Parâmetros:
     caminho (str): Caminho para o arquivo CSV.
+    usecols (list): Colunas a carregar; as demais nem são parseadas.
 
     Retorno:
     pd.DataFrame: Dados espectrais carregados.
     """
     try:
-        return pd.read_csv(caminho)
+        try:
+            # Parser C++ multithread do pyarrow, quando instalado
+            return pd.read_csv(
+                caminho, dtype=np.float32, usecols=usecols, engine="pyarrow"
+            )
+        except (ImportError, ValueError):
+            pass
+        try:
+            return pd.read_csv(caminho, dtype=np.float32, usecols=usecols)
+        except ValueError:
+            # Alguma coluna não numérica (ex.: rótulos): dtype padrão
+            return pd.read_csv(caminho, usecols=usecols)
     except Exception as e:
         st.error(f"Erro ao carregar os dados do arquivo {caminho}: {e}")
         logging.error(f"Erro ao carregar arquivo {caminho}: {e}")
@@ -36,17 +161,127 @@ def preprocessar_espectros(dados):
     dados (pd.DataFrame): Dados espectrais originais.
 
     Retorno:
-    pd.DataFrame: Dados normalizados.
+    np.ndarray: Matriz float32 contígua normalizada por soma total.
     """
     try:
-        # Normalização por soma total (percentual de cada composto)
-        dados_normalizados = dados.div(dados.sum(axis=1), axis=0)
-        return dados_normalizados
+        # Normalização por soma total (percentual de cada composto),
+        # em uma única passada e in-place sobre a matriz float32
+        arr = np.ascontiguousarray(np.asarray(dados, dtype=np.float32))
+        arr /= arr.sum(axis=1, keepdims=True)
+        return arr
     except Exception as e:
         st.error(f"Erro ao processar os dados espectrais: {e}")
         logging.error(f"Erro ao normalizar os dados: {e}")
         return None
 
+# Número mínimo de amostras de teste para valer a pena paralelizar
+LIMIAR_PARALELISMO = 512
+
+# Número de referências a partir do qual a matriz M x N completa deixa de
+# caber confortavelmente em memória e o chunkdot passa a compensar
+LIMIAR_CHUNKDOT = 100_000
+
+# Limite de memória (bytes) para os blocos do chunkdot
+MEMORIA_MAX_CHUNKDOT = int(4e9)
+
+# Volume mínimo de multiplica-acumula (M*N*D) para a transferência
+# host->GPU compensar
+LIMIAR_GPU = int(1e7)
+
+def _maximas_similaridades_gpu(test_mat, ref_mat):
+    """
+    Calcula as similaridades na GPU e devolve apenas o máximo por amostra.
+
+    Só o vetor de máximos (M valores) volta ao host, minimizando a
+    transferência device->host.
+    """
+    teste_gpu = cp.asarray(test_mat)
+    ref_gpu = cp.asarray(ref_mat)
+    sim = teste_gpu @ ref_gpu.T
+    sim /= cp.linalg.norm(teste_gpu, axis=1, keepdims=True)
+    sim /= cp.linalg.norm(ref_gpu, axis=1)[None, :]
+    return cp.asnumpy(sim.max(axis=1))
+
+def _normalizar_l2(mat, normas=None):
+    """Retorna a matriz com as linhas escaladas para norma L2 unitária."""
+    if normas is None:
+        normas = np.linalg.norm(mat, axis=1)
+    return mat / normas[:, None]
+
+def _similaridade_bloco(bloco_unit, ref_unit):
+    """Similaridades de um bloco já normalizado: GEMM puro, sem divisões."""
+    return bloco_unit @ ref_unit.T
+
+# Função para calcular similaridades em lote
+def calcular_similaridades_lote(test_mat, ref_mat, normas_referencia=None):
+    """
+    Calcula a matriz de similaridade entre todas as amostras e referências.
+
+    Parâmetros:
+    test_mat (np.ndarray): Matriz M x D com os espectros de teste.
+    ref_mat (np.ndarray): Matriz N x D com os espectros de referência.
+    normas_referencia (np.ndarray): Normas L2 pré-calculadas das referências,
+        reutilizadas entre chamadas para evitar passadas redundantes.
+
+    Retorno:
+    np.ndarray: Matriz M x N de similaridades de cosseno.
+    """
+    test_mat = np.ascontiguousarray(test_mat, dtype=np.float32)
+    ref_mat = np.ascontiguousarray(ref_mat, dtype=np.float32)
+    if NUMBA_DISPONIVEL:
+        nucleo = obter_nucleo_cosseno()
+        saida = np.empty((test_mat.shape[0], ref_mat.shape[0]), dtype=np.float32)
+        nucleo(test_mat, ref_mat, saida)
+        return saida
+    # Com as linhas normalizadas para norma unitária uma única vez, o
+    # cosseno vira um único GEMM, sem a passada de divisão sobre a saída
+    ref_unit = _normalizar_l2(ref_mat, normas_referencia)
+    test_unit = _normalizar_l2(test_mat)
+    if test_mat.shape[0] >= LIMIAR_PARALELISMO:
+        # Divide as amostras em blocos processados em paralelo; as threads
+        # compartilham ref_unit sem serialização e o BLAS libera o GIL
+        blocos = np.array_split(test_unit, cpu_count())
+        partes = Parallel(n_jobs=-1, prefer="threads")(
+            delayed(_similaridade_bloco)(bloco, ref_unit)
+            for bloco in blocos if bloco.shape[0] > 0
+        )
+        return np.vstack(partes)
+    return _similaridade_bloco(test_unit, ref_unit)
+
+# Função para calcular apenas a similaridade máxima por amostra
+def calcular_maximas_similaridades(test_mat, ref_mat, normas_referencia=None):
+    """
+    Calcula a similaridade máxima de cada amostra contra as referências.
+
+    Ao contrário de calcular_similaridades_lote, nunca materializa a matriz
+    M x N completa: o kernel Numba mantém apenas o máximo corrente e o
+    caminho NumPy processa as amostras em blocos de tamanho fixo.
+
+    Parâmetros:
+    test_mat (np.ndarray): Matriz M x D com os espectros de teste.
+    ref_mat (np.ndarray): Matriz N x D com os espectros de referência.
+    normas_referencia (np.ndarray): Normas L2 pré-calculadas das referências.
+
+    Retorno:
+    np.ndarray: Vetor M com a similaridade máxima de cada amostra.
+    """
+    test_mat = np.ascontiguousarray(test_mat, dtype=np.float32)
+    ref_mat = np.ascontiguousarray(ref_mat, dtype=np.float32)
+    if NUMBA_DISPONIVEL:
+        nucleo = obter_nucleo_cosseno_max()
+        saida = np.empty(test_mat.shape[0], dtype=np.float32)
+        nucleo(test_mat, ref_mat, saida)
+        return saida
+    ref_unit = _normalizar_l2(ref_mat, normas_referencia)
+    test_unit = _normalizar_l2(test_mat)
+    maximos = np.empty(test_mat.shape[0], dtype=np.float32)
+    for inicio in range(0, test_mat.shape[0], LIMIAR_PARALELISMO):
+        fim = inicio + LIMIAR_PARALELISMO
+        maximos[inicio:fim] = _similaridade_bloco(
+            test_unit[inicio:fim], ref_unit
+        ).max(axis=1)
+    return maximos
+
 # Função para calcular similaridade entre espectros
 def calcular_similaridade(espectro_teste, banco_referencia):
     """
@@ -57,19 +292,12 @@ def calcular_similaridade(espectro_teste, banco_referencia):
     banco_referencia (pd.DataFrame): Banco de dados de espectros puros.
 
     Retorno:
-    list: Lista de similaridades com cada espectro de referência.
+    np.ndarray: Similaridades com cada espectro de referência.
     """
-    similaridades = []
-    try:
-        for _, referencia in banco_referencia.iterrows():
-            similaridade = cosine_similarity(
-                [espectro_teste.values], [referencia.values]
-            )[0][0]
-            similaridades.append(similaridade)
-    except Exception as e:
-        st.error(f"Erro ao calcular similaridade: {e}")
-        logging.error(f"Erro ao calcular similaridade: {e}")
-    return similaridades
+    # Função puramente numérica: erros são tratados na borda do pipeline
+    referencias = np.asarray(banco_referencia)
+    teste = np.asarray(espectro_teste).reshape(1, -1)
+    return calcular_similaridades_lote(teste, referencias)[0]
 
 # Função para analisar PCA (para visualização gráfica)
 def plot_pca(dados, labels):
@@ -77,29 +305,71 @@ def plot_pca(dados, labels):
     Plota os dados espectrais em um gráfico PCA para visualização de padrões.
 
     Parâmetros:
-    dados (pd.DataFrame): Dados normalizados para PCA.
+    dados (np.ndarray): Dados normalizados para PCA.
     labels (list): Classificações associadas aos dados.
     """
     try:
-        pca = PCA(n_components=2)
+        # Solver aleatorizado: O(m·n·k) em vez da SVD completa
+        pca = PCA(n_components=2, svd_solver="randomized", random_state=0)
         componentes = pca.fit_transform(dados)
-        plt.figure(figsize=(8, 6))
-        for i, label in enumerate(set(labels)):
-            indices = [j for j, l in enumerate(labels) if l == label]
-            plt.scatter(
+        # Figura local em vez do estado global do pyplot: não acumula
+        # figuras no registro entre reexecuções do Streamlit
+        fig, ax = plt.subplots(figsize=(8, 6))
+        # Agrupamento vetorizado por rótulo: uma máscara em C por classe,
+        # com ordem determinística, em vez de varrer a lista em Python
+        labels_arr = np.asarray(labels)
+        for label in np.unique(labels_arr):
+            indices = np.flatnonzero(labels_arr == label)
+            ax.scatter(
                 componentes[indices, 0],
                 componentes[indices, 1],
                 label=label
             )
-        plt.title("Análise PCA dos Espectros")
-        plt.xlabel("PC1")
-        plt.ylabel("PC2")
-        plt.legend()
-        st.pyplot(plt)
+        ax.set_title("Análise PCA dos Espectros")
+        ax.set_xlabel("PC1")
+        ax.set_ylabel("PC2")
+        ax.legend()
+        st.pyplot(fig)
+        plt.close(fig)
     except Exception as e:
         st.error(f"Erro ao gerar o gráfico PCA: {e}")
         logging.error(f"Erro ao plotar PCA: {e}")
 
+# Densidade máxima (fração de não-zeros) a partir da qual o formato CSR
+# deixa de compensar para o banco de adulterantes
+DENSIDADE_MAX_ESPARSA = 0.25
+
+def _detectar_adulterantes_lote(test_mat, adul_mat):
+    """
+    Monta a matriz booleana M x K de detecções para todas as amostras.
+
+    Quando o banco de adulterantes é majoritariamente zero, usa CSR e só
+    inspeciona os elementos armazenados: como os espectros normalizados são
+    não negativos, qualquer zero no perfil do adulterante já satisfaz o
+    critério teste >= adulterante, e essas linhas são marcadas sem custo.
+
+    Parâmetros:
+    test_mat (np.ndarray): Matriz M x D com os espectros de teste.
+    adul_mat (np.ndarray): Matriz K x D com os perfis de adulterantes.
+
+    Retorno:
+    np.ndarray: Matriz booleana M x K de detecções.
+    """
+    densidade = np.count_nonzero(adul_mat) / adul_mat.size
+    if densidade > DENSIDADE_MAX_ESPARSA:
+        return (test_mat[:, None, :] >= adul_mat[None, :, :]).any(axis=2)
+    esparsa = csr_matrix(adul_mat)
+    nao_zeros_por_linha = np.diff(esparsa.indptr)
+    tem_zero_implicito = nao_zeros_por_linha < adul_mat.shape[1]
+    deteccoes = np.empty((test_mat.shape[0], adul_mat.shape[0]), dtype=bool)
+    deteccoes[:, tem_zero_implicito] = True
+    for j in np.flatnonzero(~tem_zero_implicito):
+        inicio, fim = esparsa.indptr[j], esparsa.indptr[j + 1]
+        colunas = esparsa.indices[inicio:fim]
+        valores = esparsa.data[inicio:fim]
+        deteccoes[:, j] = (test_mat[:, colunas] >= valores).any(axis=1)
+    return deteccoes
+
 # Função para detectar compostos adulterantes
 def detectar_adulterantes(espectro_teste, banco_adulterantes):
     """
@@ -112,15 +382,12 @@ def detectar_adulterantes(espectro_teste, banco_adulterantes):
     Retorno:
     list: Lista de adulterantes detectados.
     """
-    adulterantes_detectados = []
-    try:
-        for _, adulterante in banco_adulterantes.iterrows():
-            if any(espectro_teste.values >= adulterante.values):
-                adulterantes_detectados.append(adulterante.name)
-    except Exception as e:
-        st.error(f"Erro ao detectar adulterantes: {e}")
-        logging.error(f"Erro ao detectar adulterantes: {e}")
-    return adulterantes_detectados
+    # Comparação broadcast (K x D) de uma só vez, sem laço por adulterante;
+    # função puramente numérica, erros são tratados na borda do pipeline
+    adul_mat = np.asarray(banco_adulterantes)
+    teste = np.asarray(espectro_teste)
+    presentes = (teste[None, :] >= adul_mat).any(axis=1)
+    return banco_adulterantes.index[presentes].tolist()
 
 # Função para determinar a pureza do óleo essencial
 def determinar_pureza(similaridade, adulterantes_detectados):
@@ -158,20 +425,55 @@ def pipeline(caminho_teste, caminho_referencia, caminho_adulterantes):
     if espectros_teste is None or banco_referencia is None or banco_adulterantes is None:
         return
 
-    # Pré-processando os dados
+    # Pré-processando os dados: os rótulos ficam de lado, o restante do
+    # pipeline trabalha apenas com as matrizes float32 normalizadas
     st.write("Pré-processando dados...")
-    espectros_teste = preprocessar_espectros(espectros_teste)
-    banco_referencia = preprocessar_espectros(banco_referencia)
-    banco_adulterantes = preprocessar_espectros(banco_adulterantes)
+    nomes_adulterantes = banco_adulterantes.index
+    test_mat = preprocessar_espectros(espectros_teste)
+    ref_mat = preprocessar_espectros(banco_referencia)
+    adul_mat = preprocessar_espectros(banco_adulterantes)
+
+    if test_mat is None or ref_mat is None or adul_mat is None:
+        return
 
     # Calculando similaridades
     st.write("Calculando similaridades...")
     resultados = []
     classificacoes = []
-    for _, espectro in espectros_teste.iterrows():
-        similaridades = calcular_similaridade(espectro, banco_referencia)
-        max_similaridade = max(similaridades)
-        adulterantes = detectar_adulterantes(espectro, banco_adulterantes)
+    # Único ponto de tratamento de erro do bloco numérico: os kernels em si
+    # não carregam try/except nem chamadas ao Streamlit
+    try:
+        volume_fma = test_mat.shape[0] * ref_mat.shape[0] * test_mat.shape[1]
+        if USAR_GPU and volume_fma >= LIMIAR_GPU:
+            max_similaridades = _maximas_similaridades_gpu(test_mat, ref_mat)
+        elif CHUNKDOT_DISPONIVEL and ref_mat.shape[0] >= LIMIAR_CHUNKDOT:
+            # Só o top-1 por amostra é retido, bloco a bloco, sem nunca
+            # materializar a matriz M x N completa
+            esparsa = cosine_similarity_top_k(
+                test_mat,
+                top_k=1,
+                embeddings_right=ref_mat,
+                max_memory=MEMORIA_MAX_CHUNKDOT,
+            )
+            max_similaridades = np.asarray(esparsa.max(axis=1).todense()).ravel()
+        else:
+            # Normas das referências calculadas uma única vez e reaproveitadas;
+            # apenas o vetor de máximos é materializado
+            normas_referencia = np.linalg.norm(ref_mat, axis=1)
+            max_similaridades = calcular_maximas_similaridades(
+                test_mat, ref_mat, normas_referencia
+            )
+        # Detecção de adulterantes em lote, com caminho esparso quando o
+        # banco de adulterantes é majoritariamente zero
+        deteccoes = _detectar_adulterantes_lote(test_mat, adul_mat)
+    except Exception as e:
+        st.error(f"Erro ao calcular similaridades e adulterantes: {e}")
+        logging.error(f"Erro no bloco numérico do pipeline: {e}")
+        return
+    # Laço apenas de montagem dos resultados: zip sobre arrays já calculados,
+    # com os escalares convertidos para float nativo de uma só vez
+    for max_similaridade, presentes in zip(max_similaridades.tolist(), deteccoes):
+        adulterantes = nomes_adulterantes[presentes].tolist()
         status = determinar_pureza(max_similaridade, adulterantes)
         resultados.append({
             "similaridade": max_similaridade,
@@ -182,7 +484,7 @@ def pipeline(caminho_teste, caminho_referencia, caminho_adulterantes):
 
     # Exibindo resultados
     st.write("Visualizando com PCA...")
-    plot_pca(pd.concat([banco_referencia, espectros_teste]), classificacoes)
+    plot_pca(np.vstack([ref_mat, test_mat]), classificacoes)
 
     st.write("Resultados Finais:")
     for i, res in enumerate(resultados):
@@ -197,9 +499,3 @@ caminho_referencia = st.text_input("Caminho para o arquivo CSV do banco de refer
 caminho_adulterantes = st.text_input("Caminho para o arquivo CSV do banco de adulterantes:")
 if st.button("Executar Pipeline"):
     pipeline(caminho_teste, caminho_referencia, caminho_adulterantes)
-
-caminho_teste = st.text_input("Caminho para o arquivo CSV de amostras de teste:")
-caminho_referencia = st.text_input("Caminho para o arquivo CSV do banco de referência:")
-caminho_adulterantes = st.text_input("Caminho para o arquivo CSV do banco de adulterantes:")
-if st.button("Executar Pipeline"):
-    pipeline(caminho_teste, caminho_referencia, caminho_adulterantes)